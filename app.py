@@ -1,12 +1,9 @@
 import streamlit as st
 from openai import OpenAI
-import whisper
-import torch
-from pyannote.audio import Pipeline
 from pydub import AudioSegment
 import tempfile
 import os
-from datetime import timedelta, date, datetime
+from datetime import date, datetime, timedelta
 from docx import Document
 from docx.shared import Inches, Pt
 from io import BytesIO
@@ -15,7 +12,13 @@ import plotly.graph_objects as go
 import logging
 import sqlite3
 import zipfile
-import re
+from transcription import (
+    configure_torch_threads, load_whisper_model, transcribe, load_diarization_pipeline,
+    diarization_to_turns, merge_words_with_speakers, format_transcript_text, stream_transcription,
+)
+from talk_analytics import talk_metrics_for_report, talk_metrics_from_transcript
+import rollups
+from openai_cache import CachingOpenAIClient, ResponseCache
 
 # -------------------------------------------------------------------
 # 1. 初期設定 & ロギング・DB設定
@@ -42,7 +45,39 @@ except KeyError as e:
 
 # 各種クライアントの初期化
 WHISPER_MODEL = "small"
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 文字起こしバックエンド ("fp32" または CPU向けの動的int8量子化 "int8")
+WHISPER_BACKEND = st.secrets.get("WHISPER_BACKEND", "fp32")
+TORCH_NUM_THREADS = st.secrets.get("TORCH_NUM_THREADS", 0)
+TORCH_NUM_INTEROP_THREADS = st.secrets.get("TORCH_NUM_INTEROP_THREADS", 0)
+
+@st.cache_resource
+def init_torch_threads(num_threads, num_interop_threads):
+    """torchのスレッド数はプロセスで一度だけ設定する (interopスレッド数は再設定できないため)"""
+    configure_torch_threads(num_threads, num_interop_threads)
+
+init_torch_threads(TORCH_NUM_THREADS, TORCH_NUM_INTEROP_THREADS)
+
+# パイプラインモード ("batch" または ウィンドウごとに逐次処理する "streaming")
+PIPELINE_MODE = st.secrets.get("PIPELINE_MODE", "batch")
+STREAMING_WINDOW_SECONDS = float(st.secrets.get("STREAMING_WINDOW_SECONDS", 30))
+# OpenAI応答キャッシュ ("off" / "cache" / "record" / "replay")
+# OPENAI_BASE_URL にローカルの代替サーバー(mock_openai_server.py)を指定すると、ネットワークなしで動作する
+OPENAI_CACHE_MODE = st.secrets.get("OPENAI_CACHE_MODE", "cache")
+OPENAI_CACHE_PATH = st.secrets.get("OPENAI_CACHE_PATH", "openai_cache.db")
+OPENAI_CACHE_TTL_SECONDS = int(st.secrets.get("OPENAI_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+OPENAI_CACHE_MAX_MB = int(st.secrets.get("OPENAI_CACHE_MAX_MB", 200))
+
+@st.cache_resource
+def init_openai_client(api_key, base_url, cache_mode, cache_path, cache_ttl_seconds, cache_max_mb):
+    """ヒット率などの集計を再実行のたびにリセットしないよう、クライアントはプロセスで一度だけ作る"""
+    cache = ResponseCache(cache_path, ttl_seconds=cache_ttl_seconds, max_bytes=cache_max_mb * 1024 * 1024)
+    logging.info(f"OpenAI cache ({cache_mode}): {cache.stats()}")
+    return CachingOpenAIClient(OpenAI(api_key=api_key, base_url=base_url), cache, mode=cache_mode)
+
+client = init_openai_client(
+    OPENAI_API_KEY, st.secrets.get("OPENAI_BASE_URL"), OPENAI_CACHE_MODE,
+    OPENAI_CACHE_PATH, OPENAI_CACHE_TTL_SECONDS, OPENAI_CACHE_MAX_MB
+)
 
 # データベースの初期化
 DB_FILE = "database.db"
@@ -59,9 +94,17 @@ def init_db():
             report_date TEXT NOT NULL,
             analysis_json TEXT NOT NULL,
             report_markdown TEXT,
-            cleaned_transcript TEXT
+            cleaned_transcript TEXT,
+            talk_metrics_json TEXT
         )
     ''')
+    # 既存のDBに会話分析指標の列がなければ追加する
+    columns = [row[1] for row in c.execute("PRAGMA table_info(reports)")]
+    if "talk_metrics_json" not in columns:
+        c.execute("ALTER TABLE reports ADD COLUMN talk_metrics_json TEXT")
+    # フィードバックページの一覧 (担当者ごとに新しい順) 用
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reports_sales_rep_timestamp ON reports (sales_rep, timestamp)")
+    rollups.init_rollup_tables(conn)
     conn.commit()
     conn.close()
     logging.info("Database initialized.")
@@ -76,6 +119,7 @@ def reset_creation_page_state():
     st.session_state.negotiation_info = {}
     st.session_state.analysis_data = None
     st.session_state.transcript_display = []
+    st.session_state.talk_metrics = None
     st.session_state.chat_history = []
     st.session_state.report_for_display = ""
     st.session_state.uploaded_file = None
@@ -121,7 +165,7 @@ def get_negotiation_analysis(transcript_text, negotiation_info):
 上記の評価基準に基づき、以下の商談の文字起こしデータを分析し、各ステージの評価（A〜D）と分析内容をJSON形式で出力してください。
 
 ### 話者名の特定
-営業担当者は「{negotiation_info['sales_rep']}」です。文字起こしデータ内の「SPEAKER_00」「SPEAKER_01」などを分析し、どちらが営業担当者でどちらが顧客（{negotiation_info['client_rep']}）かを判断してください。その上で、"cleaned_transcript"内の"speaker"を、実際の名前（例：「田中真奈美（営業担当）」、「藤社長」）に置き換えてください。
+営業担当者は「{negotiation_info['sales_rep']}」です。文字起こしデータ内の「SPEAKER_00」「SPEAKER_01」などを分析し、どちらが営業担当者でどちらが顧客（{negotiation_info['client_rep']}）かを判断してください。その上で、"cleaned_transcript"内の"speaker"を、実際の名前（例：「田中真奈美（営業担当）」、「藤社長」）に置き換えてください。また、営業担当者と判断した元の話者ラベル（例：「SPEAKER_00」）を"speaker_roles"の"sales_rep"に出力してください。
 
 ### 分析対象の文字起こしデータ
 ```
@@ -131,6 +175,7 @@ def get_negotiation_analysis(transcript_text, negotiation_info):
 ### 出力フォーマット (JSON)
 ```json
 {{
+  "speaker_roles": {{ "sales_rep": "（営業担当者の元の話者ラベル。例：SPEAKER_00）" }},
   "cleaned_transcript": [
     {{ "speaker": "（話者名）", "text": "（発言内容）", "start_time": "（開始時間）" }}
   ],
@@ -182,20 +227,35 @@ def get_negotiation_analysis(transcript_text, negotiation_info):
 }}
 ```
 """
+    request = dict(
+        model="gpt-4o",
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=0.1,
+        max_tokens=4090
+    )
     try:
         logging.info("Requesting negotiation analysis from GPT-4o.")
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.1,
-            max_tokens=4090
-        )
+        response = client.chat.completions.create(**request)
         logging.info("Successfully received negotiation analysis from GPT-4o.")
-        return json.loads(response.choices[0].message.content)
+        try:
+            return json.loads(response.choices[0].message.content)
+        except json.JSONDecodeError:
+            # 壊れたJSON(途中で切れた応答など)をキャッシュに残さず、APIから一度だけ取り直す
+            # (replayモードでは記録済みの応答を消さず、取り直しもしない)
+            if not isinstance(client, CachingOpenAIClient) or client.mode == "replay":
+                raise
+            logging.warning("Invalid JSON in negotiation analysis. Dropping the cached response and retrying once.")
+            client.invalidate(**request)
+            response = client.chat.completions.create(cache_bypass=True, **request)
+            try:
+                return json.loads(response.choices[0].message.content)
+            except json.JSONDecodeError:
+                client.invalidate(**request)
+                raise
     except Exception as e:
         st.error(f"OpenAI APIでの分析中にエラー: {e}")
         logging.error(f"Error during negotiation analysis: {e}")
@@ -220,10 +280,6 @@ def get_refined_report(original_report, user_instruction):
 # -------------------------------------------------------------------
 # 4. ヘルパー関数 (Wordファイル生成, DB操作など)
 # -------------------------------------------------------------------
-def format_timestamp(seconds):
-    """秒をHH:MM:SS形式の文字列に変換する"""
-    return str(timedelta(seconds=int(seconds)))
-
 def create_minutes_docx(report_text):
     doc = Document()
     doc.add_heading('商談議事録', 0)
@@ -248,7 +304,7 @@ def create_minutes_docx(report_text):
     bio.seek(0)
     return bio.getvalue()
 
-def create_analysis_docx(analysis_data, negotiation_info, transcript_display):
+def create_analysis_docx(analysis_data, negotiation_info, talk_metrics):
     doc = Document()
     doc.add_heading('AI交渉分析レポート', 0)
     
@@ -259,7 +315,7 @@ def create_analysis_docx(analysis_data, negotiation_info, transcript_display):
     doc.add_paragraph()
 
     # 総合評価
-    score, score_breakdown = calculate_final_score(analysis_data, transcript_display, negotiation_info)
+    score, score_breakdown = calculate_final_score(analysis_data, talk_metrics)
     doc.add_heading(f"総合評価: {score}点", level=1)
     doc.add_paragraph(score_breakdown.replace("\n", " / "))
     
@@ -288,24 +344,84 @@ def create_analysis_docx(analysis_data, negotiation_info, transcript_display):
     return bio.getvalue()
 
 
-def save_report_to_db(negotiation_info, analysis_data, report_markdown, cleaned_transcript):
+def save_report_to_db(negotiation_info, analysis_data, report_markdown, cleaned_transcript, talk_metrics):
     """分析結果と最終レポートをSQLiteデータベースに保存する"""
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
     c.execute('''
-        INSERT INTO reports (timestamp, sales_rep, client_company, client_rep, report_date, analysis_json, report_markdown, cleaned_transcript)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO reports (timestamp, sales_rep, client_company, client_rep, report_date, analysis_json, report_markdown, cleaned_transcript, talk_metrics_json)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
         datetime.now().isoformat(), negotiation_info['sales_rep'], negotiation_info['client_company'],
         negotiation_info['client_rep'], negotiation_info['date'],
         json.dumps(analysis_data, ensure_ascii=False), report_markdown,
-        json.dumps(cleaned_transcript, ensure_ascii=False)
+        json.dumps(cleaned_transcript, ensure_ascii=False),
+        json.dumps(talk_metrics, ensure_ascii=False) if talk_metrics else None
     ))
+    report_id = c.lastrowid
+    record_report_rollups(conn, report_id, analysis_data, talk_metrics)
     conn.commit()
     conn.close()
     logging.info(f"Report for {negotiation_info['client_company']} saved to database.")
+    return report_id
+
+def update_report_in_db(report_id, analysis_data, report_markdown, talk_metrics):
+    """編集したレポートでDBの既存レコードと集計テーブルを更新する"""
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute(
+        "UPDATE reports SET analysis_json = ?, report_markdown = ?, talk_metrics_json = ? WHERE id = ?",
+        (json.dumps(analysis_data, ensure_ascii=False), report_markdown, json.dumps(talk_metrics, ensure_ascii=False) if talk_metrics else None, report_id)
+    )
+    record_report_rollups(conn, report_id, analysis_data, talk_metrics)
+    conn.commit()
+    conn.close()
+    logging.info(f"Report {report_id} updated in database.")
+
+def record_report_rollups(conn, report_id, analysis_data, talk_metrics):
+    """レポート1件のスコアを担当者別の集計テーブルに反映する (コミットは呼び出し側)"""
+    sales_rep, client_company, report_date = conn.execute(
+        "SELECT sales_rep, client_company, report_date FROM reports WHERE id = ?", (report_id,)
+    ).fetchone()
+    score, _ = calculate_final_score(analysis_data, talk_metrics)
+    assessment = analysis_data.get("detailed_assessment", {})
+    grades = {stage: assessment.get(stage, {}).get("score") for stage in rollups.STAGES}
+    rollups.record_report(conn, report_id, sales_rep, client_company, report_date, grades, score, (talk_metrics or {}).get('sales_ratio'))
+
+def sync_rollups():
+    """集計テーブルに未反映のレポート(機能追加前のレポートなど)を反映する"""
+    conn = sqlite3.connect(DB_FILE)
+    missing = conn.execute('''
+        SELECT id, sales_rep, analysis_json, cleaned_transcript, talk_metrics_json FROM reports
+        WHERE id NOT IN (SELECT report_id FROM report_scores)
+    ''').fetchall()
+    for report_id, sales_rep, analysis_json_str, cleaned_transcript_str, talk_metrics_str in missing:
+        if talk_metrics_str:
+            talk_metrics = json.loads(talk_metrics_str)
+        else:
+            talk_metrics = talk_metrics_from_transcript(json.loads(cleaned_transcript_str) if cleaned_transcript_str else [], sales_rep)
+            conn.execute("UPDATE reports SET talk_metrics_json = ? WHERE id = ?", (json.dumps(talk_metrics, ensure_ascii=False), report_id))
+        record_report_rollups(conn, report_id, json.loads(analysis_json_str), talk_metrics)
+    conn.commit()
+    conn.close()
+    if missing:
+        logging.info(f"Rollups synced for {len(missing)} reports.")
 
-def calculate_final_score(analysis_json, transcript_display, negotiation_info):
+def load_talk_metrics(report_id, talk_metrics_json, cleaned_transcript, sales_rep):
+    """
+    保存済みの会話分析指標を読み込む。
+    指標を持たない過去のレポートは文字起こしから算出し、次回以降のためにDBへ保存する。
+    """
+    if talk_metrics_json:
+        return json.loads(talk_metrics_json)
+    talk_metrics = talk_metrics_from_transcript(cleaned_transcript, sales_rep)
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("UPDATE reports SET talk_metrics_json = ? WHERE id = ?", (json.dumps(talk_metrics, ensure_ascii=False), report_id))
+    conn.commit()
+    conn.close()
+    logging.info(f"Talk metrics backfilled for report {report_id}.")
+    return talk_metrics
+
+def calculate_final_score(analysis_json, talk_metrics):
     """AIの質的評価(A-D)と会話バランスから最終スコアを算出する"""
     score_mapping = {"A": 20, "B": 15, "C": 10, "D": 5}
     total_score = 0
@@ -323,31 +439,10 @@ def calculate_final_score(analysis_json, transcript_display, negotiation_info):
         total_score += points
         breakdown_texts.append(f"{name}({grade}評価): {points}点")
 
-    # 会話バランスの計算とスコアリング
-    our_company_name = negotiation_info.get('sales_rep', '')
-    all_speakers = list(set(item.get('speaker', '') for item in transcript_display))
-    our_speaker_label = ''
-    our_company_last_name = our_company_name.split(' ')[0][:2]
-    for speaker in all_speakers:
-        if our_company_last_name in speaker:
-            our_speaker_label = speaker
-            break
-    
-    our_company_words = 0
-    client_words = 0
-    if transcript_display:
-        for item in transcript_display:
-            word_count = len(re.findall(r'\w+', item.get('text', '')))
-            if item.get('speaker', '') == our_speaker_label and our_speaker_label:
-                our_company_words += word_count
-            else:
-                client_words += word_count
-    
-    total_words = our_company_words + client_words
+    # 会話バランス(営業担当者の発話時間の割合)のスコアリング
+    our_ratio = (talk_metrics or {}).get('sales_ratio')
     balance_points = 0
-    our_ratio = 0
-    if total_words > 0:
-        our_ratio = (our_company_words / total_words) * 100
+    if our_ratio is not None:
         ideal_ratio = 25.0
         deviation = abs(our_ratio - ideal_ratio)
 
@@ -370,6 +465,10 @@ def calculate_final_score(analysis_json, transcript_display, negotiation_info):
     score_breakdown = " + ".join(breakdown_texts)
     return total_score, score_breakdown
 
+if "rollups_synced" not in st.session_state:
+    sync_rollups()
+    st.session_state.rollups_synced = True
+
 # -------------------------------------------------------------------
 # 5. UI描画: サイドバー
 # -------------------------------------------------------------------
@@ -436,8 +535,17 @@ if st.session_state.current_page == "creation":
     if st.session_state.analysis_stage == 'processing':
         uploaded_file = st.session_state.get('uploaded_file')
         if uploaded_file:
+            if PIPELINE_MODE == "streaming":
+                # ストリーミングモードでは、ウィンドウごとの発話を全文文字起こしタブに逐次表示する
+                tab1, tab2, tab3 = st.tabs(["📝 議事録レポート", "🤖 AIコーチング", "🗣️ 全文文字起こし"])
+                tab1.info("すべての音声の処理が完了した後に生成されます。")
+                tab2.info("すべての音声の処理が完了した後に生成されます。")
+                with tab3:
+                    st.subheader("全文文字起こし")
+                    live_transcript_container = st.container(height=600)
             with st.status("AIアシスタントが分析中です...", expanded=True) as status:
                 raw_transcript_text = ""
+                speaker_turns, utterances = [], []
                 try:
                     status.write("ステップ1/4: 音声ファイルを準備中...")
                     audio_bytes = uploaded_file.getvalue()
@@ -455,33 +563,46 @@ if st.session_state.current_page == "creation":
                     wav_path = temp_path + ".wav"; audio.export(wav_path, format="wav")
                     
                     status.update(label="✅ ステップ1/4: 音声ファイルを準備しました。")
-                    status.write("ステップ2/4: 話者を特定中...")
-                    diarization_pipeline = Pipeline.from_pretrained("pyannote/speaker-diarization-3.1", use_auth_token=HF_TOKEN)
-                    if torch.cuda.is_available(): diarization_pipeline.to(torch.device("cuda"))
-                    diarization = diarization_pipeline(wav_path)
-                    
-                    status.update(label="✅ ステップ2/4: 話者を特定しました。")
-                    status.write("ステップ3/4: 文字起こしを実行中...")
-                    device = "cuda" if torch.cuda.is_available() else "cpu"
-                    whisper_model = whisper.load_model(WHISPER_MODEL, device=device)
-                    transcription_result = whisper_model.transcribe(wav_path, word_timestamps=True, language="ja")
-                    
-                    status.update(label="✅ ステップ3/4: 文字起こしが完了しました。")
-                    status.write("ステップ4/4: 文字起こしと話者情報を結合中...")
-                    word_timestamps = [word for segment in transcription_result['segments'] for word in segment['words']]
-                    if word_timestamps:
-                        speaker_turns = [{'start': turn.start, 'end': turn.end, 'speaker': speaker} for turn, _, speaker in diarization.itertracks(yield_label=True)]
-                        for word in word_timestamps:
-                            word_center = word['start'] + (word['end'] - word['start']) / 2
-                            word['speaker'] = next((turn['speaker'] for turn in speaker_turns if turn['start'] <= word_center <= turn['end']), 'UNKNOWN')
-                        
-                        current_speaker, current_transcript, start_time = word_timestamps[0]['speaker'], "", word_timestamps[0]['start']
-                        for word in word_timestamps:
-                            if word['speaker'] != current_speaker:
-                                raw_transcript_text += f"{current_speaker} ({format_timestamp(start_time)}): {current_transcript.strip()}\n"
-                                current_speaker, current_transcript, start_time = word['speaker'], "", word['start']
-                            current_transcript += word['word']
-                        raw_transcript_text += f"{current_speaker} ({format_timestamp(start_time)}): {current_transcript.strip()}\n"
+                    if PIPELINE_MODE == "streaming":
+                        status.write("ステップ2/4: モデルを読み込み中...")
+                        diarization_pipeline = load_diarization_pipeline(HF_TOKEN)
+                        whisper_model = load_whisper_model(WHISPER_MODEL, backend=WHISPER_BACKEND)
+
+                        status.update(label="✅ ステップ2/4: モデルを読み込みました。")
+                        status.write("ステップ3/4: 話者分離と文字起こしを逐次実行中...")
+                        st.session_state.transcript_display = []
+                        for chunk in stream_transcription(wav_path, diarization_pipeline, whisper_model, backend=WHISPER_BACKEND, window_seconds=STREAMING_WINDOW_SECONDS):
+                            raw_transcript_text += chunk['transcript_text']
+                            speaker_turns.extend(chunk['speaker_turns'])
+                            utterances.extend(chunk['utterances'])
+                            st.session_state.transcript_display.extend(chunk['utterances'])
+                            status.update(label=f"ステップ3/4: 文字起こし中 ({chunk['window_index'] + 1}/{chunk['num_windows']})")
+                            for item in chunk['utterances']:
+                                line = f"**{item['speaker']}** ({item['start_time']}): {item['text']}"
+                                status.write(line)
+                                with live_transcript_container:
+                                    st.markdown(line)
+                        if chunk['time_to_first_utterance'] is not None:
+                            status.write(f"最初の発話までの時間: {chunk['time_to_first_utterance']:.1f}秒")
+
+                        status.update(label="✅ ステップ3/4: 文字起こしが完了しました。")
+                        status.write("ステップ4/4: 文字起こしと話者情報を結合中...")
+                    else:
+                        status.write("ステップ2/4: 話者を特定中...")
+                        diarization_pipeline = load_diarization_pipeline(HF_TOKEN)
+                        diarization = diarization_pipeline(wav_path)
+
+                        status.update(label="✅ ステップ2/4: 話者を特定しました。")
+                        status.write("ステップ3/4: 文字起こしを実行中...")
+                        whisper_model = load_whisper_model(WHISPER_MODEL, backend=WHISPER_BACKEND)
+                        transcription_result = transcribe(whisper_model, wav_path, backend=WHISPER_BACKEND)
+
+                        status.update(label="✅ ステップ3/4: 文字起こしが完了しました。")
+                        status.write("ステップ4/4: 文字起こしと話者情報を結合中...")
+                        word_timestamps = [word for segment in transcription_result['segments'] for word in segment['words']]
+                        speaker_turns = diarization_to_turns(diarization)
+                        utterances = merge_words_with_speakers(word_timestamps, speaker_turns)
+                        raw_transcript_text = format_transcript_text(utterances)
 
                     status.update(label="✅ ステップ4/4: 結合が完了しました。")
                     status.write("GPT-4oによる最終分析中...")
@@ -491,6 +612,14 @@ if st.session_state.current_page == "creation":
                         status.update(label="分析完了！", state="complete", expanded=False)
                         st.session_state.analysis_data = analysis_result
                         st.session_state.transcript_display = analysis_result.get('cleaned_transcript', [])
+                        # 会話分析指標はレポートごとに一度だけ算出し、スコアとグラフの双方で使い回す
+                        # speaker_roles が辞書でない応答でも、文字起こしからの見積もりにフォールバックさせる
+                        speaker_roles = analysis_result.get('speaker_roles')
+                        sales_speaker = speaker_roles.get('sales_rep') if isinstance(speaker_roles, dict) else None
+                        st.session_state.talk_metrics = talk_metrics_for_report(
+                            speaker_turns, utterances, sales_speaker,
+                            st.session_state.transcript_display, st.session_state.negotiation_info['sales_rep']
+                        )
                         st.session_state.analysis_stage = 'done'
                         st.session_state.chat_history = [{"role": "assistant", "content": "レポートとAIコーチングを生成しました。"}]
                         st.rerun()
@@ -527,6 +656,7 @@ if st.session_state.current_page == "creation":
                 with st.spinner("AIがレポートを修正中です..."):
                     refined_report = get_refined_report(st.session_state.report_for_display, prompt)
                     st.session_state.report_for_display = refined_report
+                    st.session_state.report_saved = False
                 st.session_state.chat_history.append({"role": "assistant", "content": "レポートを修正しました。"})
                 st.rerun()
             
@@ -553,6 +683,7 @@ if st.session_state.current_page == "creation":
             edited_report = st.text_area("レポート内容を直接編集", st.session_state.report_for_display, height=400, label_visibility="collapsed")
             if edited_report != st.session_state.report_for_display:
                 st.session_state.report_for_display = edited_report
+                st.session_state.report_saved = False
                 st.rerun()
 
         with tab2:
@@ -560,7 +691,7 @@ if st.session_state.current_page == "creation":
             narrative = analysis_data.get('flow_narrative_analysis', {})
             flow = analysis_data.get('detailed_assessment', {})
 
-            final_score, score_breakdown = calculate_final_score(analysis_data, st.session_state.transcript_display, st.session_state.negotiation_info)
+            final_score, score_breakdown = calculate_final_score(analysis_data, st.session_state.get('talk_metrics'))
             st.metric("総合評価スコア", f"{final_score} 点", delta=score_breakdown)
             st.markdown("---")
             
@@ -588,35 +719,24 @@ if st.session_state.current_page == "creation":
             st.markdown("---")
             st.markdown("##### 会話バランス")
             st.caption("理想の会話バランスは、営業担当者25%、顧客75％です。")
-            our_company_name = st.session_state.negotiation_info.get('sales_rep', '')
-            all_speakers = list(set(item.get('speaker', '') for item in st.session_state.transcript_display))
-            our_speaker_label = ''
-            our_company_last_name = our_company_name.split(' ')[0][:2]
-            for speaker in all_speakers:
-                if our_company_last_name in speaker:
-                    our_speaker_label = speaker
-                    break
-            
-            our_company_words = 0
-            client_words = 0
-            if st.session_state.transcript_display:
-                for item in st.session_state.transcript_display:
-                    word_count = len(re.findall(r'\w+', item.get('text', '')))
-                    if item.get('speaker', '') == our_speaker_label and our_speaker_label:
-                        our_company_words += word_count
-                    else:
-                        client_words += word_count
-            
-            total_words = our_company_words + client_words
-            if total_words > 0:
-                our_ratio = (our_company_words / total_words) * 100
-                client_ratio = (client_words / total_words) * 100
+            talk_metrics = st.session_state.get('talk_metrics') or {}
+            our_ratio = talk_metrics.get('sales_ratio')
+            if our_ratio is not None:
+                client_ratio = 100 - our_ratio
                 
                 fig = go.Figure(data=[go.Pie(labels=['顧客', '営業担当'], values=[client_ratio, our_ratio], hole=.3, marker_colors=['#636EFA', '#EF553B'])])
                 fig.update_traces(textinfo='percent+label', textfont_size=14, hovertemplate='<b>%{label}</b>: %{value:.1f}%<extra></extra>')
                 fig.update_layout(height=300, margin=dict(t=10, b=10, l=10, r=10), showlegend=False)
                 st.plotly_chart(fig, use_container_width=True)
 
+                sales_stats = talk_metrics.get('speakers', {}).get(talk_metrics.get('sales_speaker'), {})
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("営業担当のターン数", sales_stats.get('turns', 0))
+                col2.metric("割り込み回数", sales_stats.get('interruptions', 0))
+                col3.metric("最長モノローグ", f"{sales_stats.get('longest_monologue_seconds', 0):.0f} 秒")
+                col4.metric("質問頻度", f"{sales_stats.get('questions_per_minute', 0):.1f} 回/分")
+                st.caption(f"発話の重なり: 合計{talk_metrics.get('overlap_seconds', 0):.0f}秒")
+
                 if 20 <= our_ratio <= 30:
                     st.success("✔️ **理想的な会話バランスです。** 顧客の話を十分に引き出し、効果的な対話ができています。")
                 elif our_ratio > 30:
@@ -637,14 +757,17 @@ if st.session_state.current_page == "creation":
         
         def save_current_report():
             if not st.session_state.get('report_saved', False):
-                save_report_to_db(st.session_state.negotiation_info, st.session_state.analysis_data, st.session_state.report_for_display, st.session_state.transcript_display)
+                if st.session_state.get('current_report_id'):
+                    update_report_in_db(st.session_state.current_report_id, st.session_state.analysis_data, st.session_state.report_for_display, st.session_state.get('talk_metrics'))
+                else:
+                    st.session_state.current_report_id = save_report_to_db(st.session_state.negotiation_info, st.session_state.analysis_data, st.session_state.report_for_display, st.session_state.transcript_display, st.session_state.get('talk_metrics'))
                 st.session_state.report_saved = True
                 st.toast("レポートを履歴に保存しました！")
 
         minutes_docx = create_minutes_docx(st.session_state.report_for_display)
         st.sidebar.download_button("議事録ダウンロード", minutes_docx, "議事録.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", use_container_width=True, on_click=save_current_report)
         
-        analysis_docx = create_analysis_docx(analysis_data, st.session_state.negotiation_info, st.session_state.transcript_display)
+        analysis_docx = create_analysis_docx(analysis_data, st.session_state.negotiation_info, st.session_state.get('talk_metrics'))
         st.sidebar.download_button("AI分析レポートダウンロード", analysis_docx, "AI分析レポート.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", use_container_width=True, on_click=save_current_report)
 
 
@@ -656,12 +779,12 @@ elif st.session_state.current_page == "history":
         report_id = st.session_state.get("viewing_report_id")
         conn = sqlite3.connect(DB_FILE)
         c = conn.cursor()
-        c.execute("SELECT report_markdown, analysis_json, cleaned_transcript FROM reports WHERE id = ?", (report_id,))
+        c.execute("SELECT report_markdown, analysis_json, cleaned_transcript, talk_metrics_json FROM reports WHERE id = ?", (report_id,))
         data = c.fetchone()
         conn.close()
         
         if data:
-            report_markdown, analysis_json_str, cleaned_transcript_str = data
+            report_markdown, analysis_json_str, cleaned_transcript_str, talk_metrics_str = data
             
             st.subheader("レポート閲覧")
             st.markdown(report_markdown)
@@ -680,8 +803,10 @@ elif st.session_state.current_page == "history":
                     "client_rep": attendees.get('client_rep', 'N/A')
                 }
                 st.session_state.transcript_display = json.loads(cleaned_transcript_str) if cleaned_transcript_str else []
+                st.session_state.talk_metrics = load_talk_metrics(report_id, talk_metrics_str, st.session_state.transcript_display, st.session_state.negotiation_info['sales_rep'])
                 st.session_state.analysis_stage = "done"
                 st.session_state.current_page = "creation"
+                st.session_state.current_report_id = report_id
                 st.session_state.report_saved = True
                 del st.session_state['viewing_report_id']
                 st.rerun()
@@ -714,41 +839,79 @@ elif st.session_state.current_page == "feedback":
     selected_name = st.selectbox("フィードバックを見る担当者を選択してください", options=rep_names)
     
     if selected_name:
+        # 平均スコアや推移は、保存時に更新される集計テーブルから読み込む
         conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT analysis_json, report_date, client_company, cleaned_transcript FROM reports WHERE sales_rep = ? ORDER BY timestamp DESC", (selected_name,))
-        user_reports_data = c.fetchall()
+        summary = rollups.rep_summary(conn, selected_name)
         conn.close()
         
-        if not user_reports_data:
+        if not summary["n"]:
             st.warning(f"{selected_name}さんのレポートは見つかりませんでした。")
         else:
-            total_scores = []
-            for report in user_reports_data:
-                analysis_data = json.loads(report[0])
-                transcript_display = json.loads(report[3]) if report[3] else []
-                negotiation_info_feedback = {"sales_rep": selected_name}
-                score, _ = calculate_final_score(analysis_data, transcript_display, negotiation_info_feedback)
-                total_scores.append(score)
-
-            if total_scores:
-                avg_score = sum(total_scores) / len(total_scores)
-                st.success(f"{len(user_reports_data)}件の商談データに基づき、フィードバックを生成しました。")
-                st.metric("平均総合評価スコア", f"{avg_score:.1f} 点")
-                
-                if avg_score >= 80:
-                    st.info("素晴らしい成績です！安定して質の高い交渉ができています。")
-                elif avg_score >= 60:
-                    st.info("安定した交渉ができています。次は付加価値提案の質を高めることを意識してみましょう。")
-                else:
-                    st.warning("改善の余地があります。まずは顧客の課題発見に注力し、共感を示すことから始めましょう。")
+            avg_score = summary["avg_score"]
+            st.success(f"{summary['n']}件の商談データに基づき、フィードバックを生成しました。")
+            st.metric("平均総合評価スコア", f"{avg_score:.1f} 点")
+            
+            if avg_score >= 80:
+                st.info("素晴らしい成績です！安定して質の高い交渉ができています。")
+            elif avg_score >= 60:
+                st.info("安定した交渉ができています。次は付加価値提案の質を高めることを意識してみましょう。")
             else:
-                st.warning("有効なスコアデータが見つかりませんでした。")
+                st.warning("改善の余地があります。まずは顧客の課題発見に注力し、共感を示すことから始めましょう。")
+
+            granularity = "week" if st.radio("集計単位", ["週次", "日次"], horizontal=True) == "週次" else "day"
+            page_size = 20
+            num_pages = (summary["n"] + page_size - 1) // page_size
+            page = min(st.session_state.get(f"feedback_page_{selected_name}", 1), num_pages)
+            conn = sqlite3.connect(DB_FILE)
+            page_data = rollups.feedback_page_data(
+                conn, selected_name, granularity, page=page, page_size=page_size,
+                since=(date.today() - timedelta(weeks=26)).isoformat()
+            )
+            conn.close()
+            trend, comparison, clients = page_data["trend"], page_data["comparison"], page_data["clients"]
+
+            st.markdown("---")
+            st.subheader("ステージ別評価の推移")
+            stage_map = {
+                "rapport_building": "関係構築", "problem_discovery": "課題発見",
+                "value_addition": "価値提案", "closing": "合意形成とクロージング"
+            }
+            fig = go.Figure()
+            for key, stage_name in stage_map.items():
+                rows = [row for row in trend if row["stage"] == key]
+                fig.add_trace(go.Scatter(
+                    x=[row["period_start"] for row in rows], y=[row["avg_points"] for row in rows], mode="lines+markers", name=stage_name,
+                    customdata=[[row["n"], row["grades"]["A"], row["grades"]["B"], row["grades"]["C"], row["grades"]["D"]] for row in rows],
+                    hovertemplate="%{x}: %{y:.1f}点 (%{customdata[0]}件, A:%{customdata[1]} B:%{customdata[2]} C:%{customdata[3]} D:%{customdata[4]})<extra>" + stage_name + "</extra>"
+                ))
+            fig.update_layout(height=350, margin=dict(t=10, b=10, l=10, r=10), yaxis=dict(title="平均点", range=[0, 21]))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.subheader("担当者間の比較 (直近26週)")
+            fig = go.Figure()
+            for rep_name in sorted({row["sales_rep"] for row in comparison}):
+                rows = [row for row in comparison if row["sales_rep"] == rep_name]
+                fig.add_trace(go.Scatter(
+                    x=[row["period_start"] for row in rows], y=[row["avg_points"] for row in rows], mode="lines+markers", name=rep_name,
+                    line=dict(width=4 if rep_name == selected_name else 1.5)
+                ))
+            fig.update_layout(height=350, margin=dict(t=10, b=10, l=10, r=10), yaxis=dict(title="平均総合スコア", range=[0, 101]))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.subheader("顧客企業別の内訳")
+            fig = go.Figure(data=[go.Bar(
+                x=[row["client_company"] for row in clients], y=[row["avg_score"] for row in clients],
+                customdata=[row["n"] for row in clients], marker_color='#636EFA',
+                hovertemplate="<b>%{x}</b>: %{y:.1f}点 (%{customdata}件)<extra></extra>"
+            )])
+            fig.update_layout(height=300, margin=dict(t=10, b=10, l=10, r=10), yaxis=dict(title="平均総合スコア", range=[0, 101]))
+            st.plotly_chart(fig, use_container_width=True)
 
             st.markdown("---")
             st.subheader("過去のAIコーチングフィードバック一覧")
+            st.number_input(f"ページ (全{num_pages}ページ・{page_size}件ずつ)", min_value=1, max_value=num_pages, key=f"feedback_page_{selected_name}")
 
-            for i, report_data in enumerate(user_reports_data):
+            for i, report_data in enumerate(page_data["reports"]):
                 analysis_data = json.loads(report_data[0])
                 report_date = report_data[1]
                 client_company = report_data[2]
@@ -0,0 +1,174 @@
+"""
+担当者別集計テーブル(rollups)のベンチマーク。
+
+合成した商談レポートを一時DBに保存しながら集計テーブルを差分更新し、
+フィードバックページが1回の表示で発行するクエリ(集計値と、レポート一覧の1ページ分)の
+応答時間を計測する。
+比較のため、analysis_json を毎回読み直して集計する従来方式の時間も計測する。
+
+使い方:
+    python benchmarks/rollup_queries.py --reports 100000
+"""
+import argparse
+import json
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+import rollups  # noqa: E402
+
+REP_NAMES = ["田中真奈美", "渡辺徹", "小林恭子", "斎藤学", "工藤新一"]
+PAGE_SIZE = 20
+
+
+def create_reports_table(conn):
+    conn.execute('''
+        CREATE TABLE reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            sales_rep TEXT NOT NULL,
+            client_company TEXT NOT NULL,
+            report_date TEXT NOT NULL,
+            analysis_json TEXT NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX idx_reports_sales_rep_timestamp ON reports (sales_rep, timestamp)")
+    rollups.init_rollup_tables(conn)
+
+
+def synthetic_report(rng, start_day, num_days, num_clients):
+    day = start_day + timedelta(days=rng.randrange(num_days))
+    grades = {stage: rng.choice("AABBBCCD") for stage in rollups.STAGES}
+    analysis = {
+        "detailed_assessment": {stage: {"score": grade, "comment": "合成データ"} for stage, grade in grades.items()},
+        "flow_narrative_analysis": {"narrative_comment": "合成データ"},
+    }
+    total_score = sum(rollups.GRADE_POINTS[grade] for grade in grades.values()) + rng.choice([0, 5, 10, 15, 20])
+    return (
+        rng.choice(REP_NAMES), f"顧客企業{rng.randrange(num_clients):04d}", day.strftime('%Y年%m月%d日'),
+        grades, total_score, analysis,
+    )
+
+
+def timed(func, repeat):
+    """関数を repeat 回実行し、各回の所要時間(ミリ秒)を返す"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def naive_dashboard(conn, sales_rep):
+    """従来方式: 担当者の全レポートの analysis_json を読み直して週次のステージ別平均を求める"""
+    weekly = {}
+    for report_date, analysis_json in conn.execute("SELECT report_date, analysis_json FROM reports WHERE sales_rep = ?", (sales_rep,)):
+        analysis = json.loads(analysis_json)
+        week = rollups._period_start(rollups.parse_report_date(report_date), "week")
+        for stage in rollups.STAGES:
+            grade = analysis["detailed_assessment"][stage]["score"]
+            total, n = weekly.get((week, stage), (0, 0))
+            weekly[(week, stage)] = (total + rollups.GRADE_POINTS.get(grade, 0), n + 1)
+    return weekly
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=100_000, help="合成するレポート数")
+    parser.add_argument("--clients", type=int, default=500, help="顧客企業数")
+    parser.add_argument("--days", type=int, default=3 * 365, help="商談日の分布期間(日)")
+    parser.add_argument("--repeat", type=int, default=50, help="各クエリの計測回数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start_day = date.today() - timedelta(days=args.days)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn = sqlite3.connect(str(Path(tmp_dir) / "bench.db"))
+        create_reports_table(conn)
+
+        # 保存: 1件ごとにレポートの挿入と集計テーブルの差分更新を行う
+        # 集計テーブルの差分更新(record_report)のみの時間を、INSERTやコミットとは分けて計測する
+        record_durations = []
+        start = time.perf_counter()
+        for i in range(args.reports):
+            sales_rep, client_company, report_date, grades, total_score, analysis = synthetic_report(rng, start_day, args.days, args.clients)
+            timestamp = (datetime(start_day.year, start_day.month, start_day.day) + timedelta(seconds=i * args.days * 86400 // args.reports)).isoformat()
+            cursor = conn.execute(
+                "INSERT INTO reports (timestamp, sales_rep, client_company, report_date, analysis_json) VALUES (?, ?, ?, ?, ?)",
+                (timestamp, sales_rep, client_company, report_date, json.dumps(analysis, ensure_ascii=False)),
+            )
+            record_start = time.perf_counter()
+            rollups.record_report(conn, cursor.lastrowid, sales_rep, client_company, report_date, grades, total_score)
+            record_durations.append((time.perf_counter() - record_start) * 1000)
+            if i % 1000 == 999:
+                conn.commit()
+        conn.commit()
+        insert_seconds = time.perf_counter() - start
+
+        # 編集: 既存レポートの再集計 (以前の寄与を差し引いて加算し直す)
+        def edit_random_report():
+            report_id = rng.randrange(1, args.reports + 1)
+            sales_rep, client_company, report_date = conn.execute(
+                "SELECT sales_rep, client_company, report_date FROM reports WHERE id = ?", (report_id,)
+            ).fetchone()
+            grades = {stage: rng.choice("ABCD") for stage in rollups.STAGES}
+            rollups.record_report(conn, report_id, sales_rep, client_company, report_date, grades, rng.randrange(20, 101))
+            conn.commit()
+
+        rows_stage = conn.execute("SELECT COUNT(*) FROM rep_stage_rollups").fetchone()[0]
+        rows_client = conn.execute("SELECT COUNT(*) FROM rep_client_rollups").fetchone()[0]
+        since = (date.today() - timedelta(weeks=26)).isoformat()
+
+        def for_each_rep(query):
+            return lambda: query(REP_NAMES[rng.randrange(len(REP_NAMES))])
+
+        def feedback_page(rep, page):
+            """フィードバックページ1回分のクエリ一式 (件数・推移・比較・顧客別・一覧の1ページ)"""
+            summary = rollups.rep_summary(conn, rep)
+            num_pages = max(1, (summary["n"] + PAGE_SIZE - 1) // PAGE_SIZE)
+            return rollups.feedback_page_data(conn, rep, "week", page=min(page, num_pages), page_size=PAGE_SIZE, since=since)
+
+        measurements = [
+            ("保存時の差分更新 (record_report, 1件)", record_durations),
+            ("編集時の再集計 (1件)", timed(edit_random_report, args.repeat)),
+            ("rep_summary", timed(for_each_rep(lambda rep: rollups.rep_summary(conn, rep)), args.repeat)),
+            ("stage_trend (週次)", timed(for_each_rep(lambda rep: rollups.stage_trend(conn, rep, "week")), args.repeat)),
+            ("stage_trend (日次)", timed(for_each_rep(lambda rep: rollups.stage_trend(conn, rep, "day")), args.repeat)),
+            ("rep_comparison (週次・直近26週)", timed(lambda: rollups.rep_comparison(conn, "week", since=since), args.repeat)),
+            ("client_breakdown", timed(for_each_rep(lambda rep: rollups.client_breakdown(conn, rep)), args.repeat)),
+            (f"recent_reports (先頭ページ, {PAGE_SIZE}件)", timed(for_each_rep(lambda rep: rollups.recent_reports(conn, rep, PAGE_SIZE)), args.repeat)),
+            (f"recent_reports (50ページ目, {PAGE_SIZE}件)", timed(for_each_rep(lambda rep: rollups.recent_reports(conn, rep, PAGE_SIZE, 49 * PAGE_SIZE)), args.repeat)),
+            ("一覧 (ページングなし・全件)", timed(for_each_rep(lambda rep: conn.execute(
+                "SELECT analysis_json, report_date, client_company FROM reports WHERE sales_rep = ? ORDER BY timestamp DESC", (rep,)
+            ).fetchall()), max(3, args.repeat // 10))),
+            ("フィードバックページ全体 (先頭ページ)", timed(for_each_rep(lambda rep: feedback_page(rep, 1)), args.repeat)),
+            ("フィードバックページ全体 (50ページ目)", timed(for_each_rep(lambda rep: feedback_page(rep, 50)), args.repeat)),
+            ("従来方式 (analysis_jsonを再集計)", timed(for_each_rep(lambda rep: naive_dashboard(conn, rep)), max(3, args.repeat // 10))),
+        ]
+        conn.close()
+
+    print(f"# 集計テーブルのベンチマーク (レポート{args.reports:,}件, 顧客{args.clients}社, 期間{args.days}日)")
+    print()
+    print(f"集計行数: rep_stage_rollups={rows_stage:,}, rep_client_rollups={rows_client:,} / 保存の合計時間 (INSERT・差分更新・コミット) {insert_seconds:.1f}秒")
+    print()
+    print("| 処理 | 中央値(ms) | p95(ms) |")
+    print("|---|---:|---:|")
+    for name, durations in measurements:
+        durations = sorted(durations)
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        print(f"| {name} | {statistics.median(durations):.2f} | {p95:.2f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+ストリーミング文字起こしの「最初の発話までの時間」(time-to-first-utterance) を計測する。
+
+stream_transcription() はStreamlitに依存しないジェネレータなので、そのままスクリプトから利用できる。
+比較のため、一括処理(話者分離→文字起こし→結合)で最初の発話が得られるまでの時間も計測する。
+
+使い方:
+    HF_TOKEN=... python benchmarks/streaming_latency.py --window 30 --backend int8
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from transcription import (  # noqa: E402
+    diarization_to_turns, load_diarization_pipeline, load_whisper_model,
+    merge_words_with_speakers, stream_transcription, transcribe,
+)
+
+
+def measure_batch(audio_path, diarization_pipeline, whisper_model, backend):
+    """一括処理では、全処理が終わるまで最初の発話が得られない"""
+    start = time.perf_counter()
+    diarization = diarization_pipeline(str(audio_path))
+    result = transcribe(whisper_model, str(audio_path), backend=backend)
+    word_timestamps = [word for segment in result['segments'] for word in segment['words']]
+    merge_words_with_speakers(word_timestamps, diarization_to_turns(diarization))
+    return time.perf_counter() - start
+
+
+def measure_streaming(audio_path, diarization_pipeline, whisper_model, backend, window_seconds):
+    start = time.perf_counter()
+    time_to_first_utterance = None
+    num_utterances = 0
+    for chunk in stream_transcription(str(audio_path), diarization_pipeline, whisper_model, backend=backend, window_seconds=window_seconds):
+        num_utterances += len(chunk['utterances'])
+        time_to_first_utterance = chunk['time_to_first_utterance']
+        print(f"  window {chunk['window_index'] + 1}/{chunk['num_windows']}: {len(chunk['utterances'])} utterances at {chunk['elapsed_seconds']:.1f}s", file=sys.stderr)
+    return time_to_first_utterance, time.perf_counter() - start, num_utterances
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", default=str(ROOT_DIR / "sample_negotiations"), help="音声ファイルのディレクトリ")
+    parser.add_argument("--model", default="small", help="Whisperモデル名")
+    parser.add_argument("--backend", default="fp32", choices=("fp32", "int8"))
+    parser.add_argument("--window", type=float, default=30.0, help="ウィンドウ長(秒)")
+    args = parser.parse_args()
+
+    diarization_pipeline = load_diarization_pipeline(os.environ["HF_TOKEN"])
+    whisper_model = load_whisper_model(args.model, backend=args.backend)
+
+    print("| ファイル | 一括処理: 最初の発話(秒) | ストリーミング: 最初の発話(秒) | ストリーミング: 全体(秒) | 発話数 |")
+    print("|---|---:|---:|---:|---:|")
+    for audio_path in sorted(p for p in Path(args.samples).iterdir() if p.suffix.lower() in (".mp3", ".wav", ".m4a")):
+        batch_seconds = measure_batch(audio_path, diarization_pipeline, whisper_model, args.backend)
+        ttfu, total, num_utterances = measure_streaming(audio_path, diarization_pipeline, whisper_model, args.backend, args.window)
+        ttfu_display = f"{ttfu:.1f}" if ttfu is not None else "-"
+        print(f"| {audio_path.name} | {batch_seconds:.1f} | {ttfu_display} | {total:.1f} | {num_utterances} |")
+
+
+if __name__ == "__main__":
+    main()
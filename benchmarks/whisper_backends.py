@@ -0,0 +1,254 @@
+"""
+Whisper推論バックエンド(fp32 / int8)の比較ベンチマーク。
+
+sample_negotiations/ の各音声をバックエンドごとに別プロセスで文字起こしし、
+実時間係数(RTF)・読込後とピークのメモリ・fp32の文字起こしを基準とした文字誤り率(CER)を出力する。
+int8は読み込み時にfp32モデルを経由するため、ピークメモリよりも読込後のメモリで比較する。
+
+学習済みの重みをダウンロードできない環境では --synthetic を指定すると、同じ構造の
+ランダム初期化モデルで重みサイズ・ピークメモリ・エンコーダ/デコーダの処理時間のみを計測する
+(重みが無意味なためCERとRTFは計測できない)。
+
+使い方:
+    python benchmarks/whisper_backends.py --threads 4 --output benchmarks/whisper_backends.md
+    python benchmarks/whisper_backends.py --synthetic --threads 1
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import unicodedata
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+SAMPLE_RATE = 16000
+SYNTHETIC_DECODER_STEPS = 32
+
+# --synthetic で使うモデル構造 (openai-whisper の公開チェックポイントと同じ次元)
+MODEL_DIMS = {
+    "tiny": dict(n_audio_state=384, n_audio_head=6, n_audio_layer=4, n_text_state=384, n_text_head=6, n_text_layer=4),
+    "base": dict(n_audio_state=512, n_audio_head=8, n_audio_layer=6, n_text_state=512, n_text_head=8, n_text_layer=6),
+    "small": dict(n_audio_state=768, n_audio_head=12, n_audio_layer=12, n_text_state=768, n_text_head=12, n_text_layer=12),
+}
+
+
+def normalize_text(text):
+    """CER計算用に空白と句読点・記号を取り除く"""
+    return "".join(
+        ch for ch in unicodedata.normalize("NFKC", text)
+        if not ch.isspace() and not unicodedata.category(ch).startswith(("P", "S"))
+    )
+
+
+def character_error_rate(reference, hypothesis):
+    """文字単位のレーベンシュタイン距離からCERを算出する"""
+    ref, hyp = normalize_text(reference), normalize_text(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def run_worker(backend, audio_path, model_name, threads):
+    """子プロセス内で1ファイル分の文字起こしを行い、結果をJSONで標準出力に書き出す"""
+    import gc
+    import whisper
+    from transcription import configure_torch_threads, load_whisper_model, transcribe
+
+    configure_torch_threads(threads)
+    audio = whisper.load_audio(audio_path)
+
+    load_start = time.perf_counter()
+    model = load_whisper_model(model_name, backend=backend, device="cpu")
+    load_seconds = time.perf_counter() - load_start
+    gc.collect()
+    # int8は読み込み時にfp32モデルを経由するため、ピークRSSとは別に読み込み後の常駐メモリを記録する
+    loaded_rss_mb = current_rss_mb()
+
+    start = time.perf_counter()
+    result = transcribe(model, audio, backend=backend)
+    elapsed = time.perf_counter() - start
+
+    # Linuxでは ru_maxrss はKB単位
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({
+        "text": result["text"],
+        "audio_seconds": len(audio) / SAMPLE_RATE,
+        "load_seconds": load_seconds,
+        "transcribe_seconds": elapsed,
+        "loaded_rss_mb": loaded_rss_mb,
+        "peak_rss_mb": peak_rss_mb,
+    }, ensure_ascii=False))
+
+
+def current_rss_mb():
+    """現在の常駐メモリ(MB)。Linuxの /proc から読む。"""
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmRSS:")) / 1024
+
+
+def run_synthetic_worker(backend, checkpoint_path, threads):
+    """子プロセス内でランダム初期化モデルの重みサイズと順伝播の時間を計測する"""
+    import gc
+    import io
+    import torch
+    import whisper
+    from transcription import configure_torch_threads, load_whisper_model
+
+    configure_torch_threads(threads)
+    model = load_whisper_model(checkpoint_path, backend=backend, device="cpu")
+    gc.collect()
+    # int8は読み込み時にfp32モデルを経由するため、ピークRSSとは別に読み込み後の常駐メモリを記録する
+    loaded_rss_mb = current_rss_mb()
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+
+    mel = torch.randn(1, model.dims.n_mels, whisper.audio.N_FRAMES)
+    tokens = torch.tensor([[whisper.tokenizer.get_tokenizer(True).sot]])
+    with torch.no_grad():
+        start = time.perf_counter()
+        audio_features = model.embed_audio(mel)
+        encoder_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(SYNTHETIC_DECODER_STEPS):
+            next_token = model.logits(tokens, audio_features)[:, -1].argmax(dim=-1, keepdim=True)
+            tokens = torch.cat([tokens, next_token], dim=-1)
+        decoder_seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        "weights_mb": buffer.getbuffer().nbytes / 1024 / 1024,
+        "encoder_seconds": encoder_seconds,
+        "decoder_ms_per_token": decoder_seconds * 1000 / SYNTHETIC_DECODER_STEPS,
+        "loaded_rss_mb": loaded_rss_mb,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def run_synthetic(model_name, threads):
+    """ランダム初期化したモデルのチェックポイントを作り、バックエンドごとに別プロセスで計測する"""
+    import tempfile
+    import torch
+    from whisper.model import ModelDimensions, Whisper
+
+    dims = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_vocab=51865, n_text_ctx=448, **MODEL_DIMS[model_name])
+    lines = [
+        f"# Whisper推論バックエンド比較 (ランダム初期化の{model_name}構造, threads={threads or 'default'})",
+        "",
+        f"| バックエンド | 重みサイズ(MB) | 読込後RSS(MB) | ピークRSS(MB) | エンコーダ 30秒窓(秒) | デコーダ(ms/トークン, {SYNTHETIC_DECODER_STEPS}トークン) |",
+        "|---|---:|---:|---:|---:|---:|",
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        checkpoint_path = str(Path(tmp_dir) / f"{model_name}_random.pt")
+        torch.save({"dims": dims.__dict__, "model_state_dict": Whisper(dims).state_dict()}, checkpoint_path)
+        for backend in ("fp32", "int8"):
+            print(f"[{backend}] synthetic {model_name} ...", file=sys.stderr)
+            completed = subprocess.run(
+                [sys.executable, __file__, "--synthetic-worker", backend, checkpoint_path, "--threads", str(threads)],
+                capture_output=True, text=True, check=True,
+            )
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            lines.append(
+                f"| {backend} | {result['weights_mb']:.0f} | {result['loaded_rss_mb']:.0f} | {result['peak_rss_mb']:.0f} | "
+                f"{result['encoder_seconds']:.2f} | {result['decoder_ms_per_token']:.1f} |"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def run_in_subprocess(backend, audio_path, model_name, threads):
+    """メモリ計測を独立させるため、1回の計測ごとに別プロセスを起動する"""
+    completed = subprocess.run(
+        [sys.executable, __file__, "--worker", backend, str(audio_path), "--model", model_name, "--threads", str(threads)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def format_report(rows, model_name, threads):
+    lines = [
+        f"# Whisper推論バックエンド比較 (model={model_name}, threads={threads or 'default'})",
+        "",
+        "| ファイル | 音声長(秒) | バックエンド | 読込(秒) | 文字起こし(秒) | RTF | 読込後RSS(MB) | ピークRSS(MB) | CER(対fp32) |",
+        "|---|---:|---|---:|---:|---:|---:|---:|---:|",
+    ]
+    for row in rows:
+        lines.append(
+            f"| {row['file']} | {row['audio_seconds']:.1f} | {row['backend']} | {row['load_seconds']:.1f} | "
+            f"{row['transcribe_seconds']:.1f} | {row['rtf']:.3f} | {row['loaded_rss_mb']:.0f} | {row['peak_rss_mb']:.0f} | {row['cer'] * 100:.2f}% |"
+        )
+
+    lines += ["", "| バックエンド | 平均RTF | 平均読込後RSS(MB) | 平均ピークRSS(MB) | 平均CER(対fp32) |", "|---|---:|---:|---:|---:|"]
+    for backend in sorted({row["backend"] for row in rows}):
+        subset = [row for row in rows if row["backend"] == backend]
+        lines.append(
+            f"| {backend} | {sum(r['rtf'] for r in subset) / len(subset):.3f} | "
+            f"{sum(r['loaded_rss_mb'] for r in subset) / len(subset):.0f} | "
+            f"{sum(r['peak_rss_mb'] for r in subset) / len(subset):.0f} | "
+            f"{sum(r['cer'] for r in subset) / len(subset) * 100:.2f}% |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", default=str(ROOT_DIR / "sample_negotiations"), help="音声ファイルのディレクトリ")
+    parser.add_argument("--model", default="small", help="Whisperモデル名")
+    parser.add_argument("--threads", type=int, default=0, help="torchのスレッド数 (0は既定値)")
+    parser.add_argument("--output", help="Markdownレポートの出力先")
+    parser.add_argument("--synthetic", action="store_true", help="学習済みの重みを使わず、ランダム初期化モデルで速度とメモリのみ計測する")
+    parser.add_argument("--worker", nargs=2, metavar=("BACKEND", "AUDIO"), help=argparse.SUPPRESS)
+    parser.add_argument("--synthetic-worker", nargs=2, metavar=("BACKEND", "CHECKPOINT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], args.worker[1], args.model, args.threads)
+        return
+    if args.synthetic_worker:
+        run_synthetic_worker(args.synthetic_worker[0], args.synthetic_worker[1], args.threads)
+        return
+    if args.synthetic:
+        report = run_synthetic(args.model, args.threads)
+        print(report)
+        if args.output:
+            Path(args.output).write_text(report, encoding="utf-8")
+        return
+
+    audio_files = sorted(p for p in Path(args.samples).iterdir() if p.suffix.lower() in (".mp3", ".wav", ".m4a"))
+    rows = []
+    for audio_path in audio_files:
+        reference = None
+        for backend in ("fp32", "int8"):
+            print(f"[{backend}] {audio_path.name} ...", file=sys.stderr)
+            result = run_in_subprocess(backend, audio_path, args.model, args.threads)
+            if backend == "fp32":
+                reference = result["text"]
+            rows.append({
+                "file": audio_path.name,
+                "backend": backend,
+                "audio_seconds": result["audio_seconds"],
+                "load_seconds": result["load_seconds"],
+                "transcribe_seconds": result["transcribe_seconds"],
+                "rtf": result["transcribe_seconds"] / result["audio_seconds"],
+                "loaded_rss_mb": result["loaded_rss_mb"],
+                "peak_rss_mb": result["peak_rss_mb"],
+                "cer": character_error_rate(reference, result["text"]),
+            })
+
+    report = format_report(rows, args.model, args.threads)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+OpenAI互換のローカル代替サーバー。
+
+openai_cache.py のキャッシュDBに記録された応答を、同じキャッシュキーで決定的に返す。
+ネットワークなしでアプリやベンチマークを動かすために使う。
+
+使い方:
+    # 1. 実APIで応答を記録する (secrets.toml で OPENAI_CACHE_MODE = "record")
+    # 2. 記録した応答を返すサーバーを起動する
+    python mock_openai_server.py --cache openai_cache.db --port 8001
+    # 3. secrets.toml で OPENAI_BASE_URL = "http://127.0.0.1:8001/v1" を設定して起動する
+"""
+import argparse
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai_cache import ResponseCache, cache_key
+
+
+def echo_completion(params):
+    """未記録のリクエストに対して、最後のユーザー発言をそのまま返す決定的な応答を作る"""
+    user_messages = [m.get("content", "") for m in params.get("messages", []) if m.get("role") == "user"]
+    return json.dumps({
+        "id": f"chatcmpl-echo-{cache_key(params)[:24]}",
+        "object": "chat.completion",
+        "created": 0,
+        "model": params.get("model", "echo"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": user_messages[-1] if user_messages else ""},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }, ensure_ascii=False)
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    cache = None
+    on_miss = "error"
+
+    def _send_json(self, status, body):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "gpt-4o", "object": "model", "created": 0, "owned_by": "local"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path: {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path: {self.path}", "type": "invalid_request_error"}})
+            return
+        params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        # サーバーからの応答はAPIの節約ではないため、ヒット数には数えない
+        cached = self.cache.get(cache_key(params), ignore_ttl=True, touch=False)
+        if cached is not None:
+            logging.info(f"Replayed cached response for {params.get('model')}.")
+            self._send_json(200, cached[0])
+        elif self.on_miss == "echo":
+            self._send_json(200, echo_completion(params))
+        else:
+            self._send_json(404, {"error": {"message": "No recorded response for this request.", "type": "cache_miss", "code": "cache_miss"}})
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s" % (self.address_string(), format % args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cache", default="openai_cache.db", help="記録済み応答のキャッシュDB")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--on-miss", choices=("error", "echo"), default="error", help="未記録のリクエストへの応答方法")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ReplayHandler.cache = ResponseCache(args.cache, ttl_seconds=None, max_bytes=None)
+    ReplayHandler.on_miss = args.on_miss
+    server = ThreadingHTTPServer((args.host, args.port), ReplayHandler)
+    logging.info(f"Serving OpenAI-compatible replay API on http://{args.host}:{args.port}/v1 (cache: {args.cache})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
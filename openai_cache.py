@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion
+
+# -------------------------------------------------------------------
+# OpenAI API 応答のローカルキャッシュ
+# -------------------------------------------------------------------
+# off:    キャッシュを使わず常にAPIを呼び出す
+# cache:  キャッシュにあれば再利用し、なければAPIを呼び出して保存する (TTLと容量で削除)
+# record: 常にAPIを呼び出し、応答を保存する (テスト用の応答を記録する。記録はTTLと容量では削除しない)
+# replay: キャッシュの応答のみを返し、APIは呼び出さない (オフライン実行用)
+CACHE_MODES = ("off", "cache", "record", "replay")
+
+# キーに含めない、通信制御用の引数
+_NON_KEY_PARAMS = ("extra_headers", "extra_query", "extra_body", "timeout")
+
+
+class CacheMissError(RuntimeError):
+    """replayモードで、キャッシュに該当する応答がない場合のエラー"""
+
+
+def cache_key(params):
+    """モデル・メッセージ・その他のパラメータからキャッシュキーを作る"""
+    keyed = {k: v for k, v in params.items() if k not in _NON_KEY_PARAMS}
+    payload = json.dumps(keyed, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLiteに保存するOpenAI応答のキャッシュ"""
+
+    def __init__(self, db_path="openai_cache.db", ttl_seconds=7 * 24 * 3600, max_bytes=200 * 1024 * 1024):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                request_json TEXT NOT NULL,
+                response_json TEXT NOT NULL,
+                total_tokens INTEGER NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0,
+                recorded INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # 既存のDBに記録フラグの列がなければ追加する
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(responses)")]
+        if "recorded" not in columns:
+            conn.execute("ALTER TABLE responses ADD COLUMN recorded INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_accessed ON responses (last_accessed)")
+        conn.commit()
+        conn.close()
+
+    def get(self, key, ignore_ttl=False, touch=True):
+        """
+        キャッシュされた応答(JSON文字列)とトークン数を返す。期限切れ・未登録ならNone。
+        touch=False では最終利用時刻とヒット数を更新しない (代替サーバーからの読み出し用)。
+        """
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute("SELECT response_json, total_tokens, created_at, recorded FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            conn.close()
+            return None
+        response_json, total_tokens, created_at, recorded = row
+        if not ignore_ttl and not recorded and self.ttl_seconds and now - created_at > self.ttl_seconds:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+            conn.close()
+            return None
+        if touch:
+            conn.execute("UPDATE responses SET last_accessed = ?, hit_count = hit_count + 1 WHERE key = ?", (now, key))
+            conn.commit()
+        conn.close()
+        return response_json, total_tokens
+
+    def put(self, key, params, response_json, total_tokens, recorded=False):
+        """
+        応答を保存し、期限切れの応答と容量超過分(最終利用が古い順)を削除する。
+        recorded=True で保存した応答(recordモードの記録)は削除の対象にしない。
+        """
+        now = time.time()
+        request_json = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        size_bytes = len(request_json.encode("utf-8")) + len(response_json.encode("utf-8"))
+        conn = sqlite3.connect(self.db_path)
+        # 記録済みの応答をcacheモードで保存し直しても、記録フラグは外さない
+        conn.execute('''
+            INSERT INTO responses (key, model, request_json, response_json, total_tokens, size_bytes, created_at, last_accessed, recorded)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                model = excluded.model, request_json = excluded.request_json, response_json = excluded.response_json,
+                total_tokens = excluded.total_tokens, size_bytes = excluded.size_bytes, created_at = excluded.created_at,
+                last_accessed = excluded.last_accessed, hit_count = 0, recorded = MAX(recorded, excluded.recorded)
+        ''', (key, params.get("model"), request_json, response_json, total_tokens, size_bytes, now, now, int(recorded)))
+        self._evict(conn, now)
+        conn.commit()
+        conn.close()
+
+    def delete(self, key):
+        """応答を削除する (壊れた応答を次回の呼び出しで取り直すため)"""
+        conn = sqlite3.connect(self.db_path)
+        deleted = conn.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+        conn.commit()
+        conn.close()
+        return deleted > 0
+
+    def stats(self):
+        """保存中の応答数と、これまでのヒット数・節約できたトークン数 (プロセスをまたいで累計)"""
+        conn = sqlite3.connect(self.db_path)
+        entries, hits, saved_tokens = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(hit_count), 0), COALESCE(SUM(hit_count * total_tokens), 0) FROM responses"
+        ).fetchone()
+        conn.close()
+        return {"entries": entries, "hits": hits, "saved_tokens": saved_tokens}
+
+    def _evict(self, conn, now):
+        # 記録(recorded = 1)は削除せず、容量の上限もキャッシュした応答のみに適用する
+        if self.ttl_seconds:
+            conn.execute("DELETE FROM responses WHERE recorded = 0 AND created_at < ?", (now - self.ttl_seconds,))
+        if not self.max_bytes:
+            return
+        total_bytes = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM responses WHERE recorded = 0").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        evicted = []
+        for key, size_bytes in conn.execute("SELECT key, size_bytes FROM responses WHERE recorded = 0 ORDER BY last_accessed"):
+            if total_bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total_bytes -= size_bytes
+        conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        logging.info(f"OpenAI cache evicted {len(evicted)} entries to stay under {self.max_bytes} bytes.")
+
+
+class CachingOpenAIClient:
+    """
+    OpenAIクライアントをラップし、chat.completions.create の応答をキャッシュする。
+    呼び出し側は通常のクライアントと同じく client.chat.completions.create(...) を使う。
+    cache_bypass=True を渡すとキャッシュを参照せずにAPIを呼び出し、応答を保存し直す。
+    """
+
+    def __init__(self, client, cache, mode="cache"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown OpenAI cache mode: {mode} (expected one of {CACHE_MODES})")
+        self._client = client
+        self.cache = cache
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat_completion))
+
+    def __getattr__(self, name):
+        # キャッシュ対象外のAPIはそのまま元のクライアントに委譲する
+        return getattr(self._client, name)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def invalidate(self, **params):
+        """
+        create に渡したのと同じ引数の応答をキャッシュから削除する。
+        replayモードでは記録済みの応答を残すため、何もしない。
+        """
+        if self.mode == "replay":
+            return False
+        params.pop("cache_bypass", None)
+        return self.cache.delete(cache_key(params))
+
+    def _create_chat_completion(self, cache_bypass=False, **params):
+        if self.mode == "off" or params.get("stream"):
+            return self._client.chat.completions.create(**params)
+
+        key = cache_key(params)
+        if cache_bypass and self.mode == "replay":
+            raise CacheMissError("Cannot bypass the OpenAI cache in replay mode.")
+        if self.mode in ("cache", "replay") and not cache_bypass:
+            cached = self.cache.get(key, ignore_ttl=self.mode == "replay")
+            if cached is not None:
+                response_json, total_tokens = cached
+                self.hits += 1
+                self.saved_tokens += total_tokens
+                logging.info(f"OpenAI cache hit ({params.get('model')}): hit rate {self.hit_rate:.0%}, saved tokens {self.saved_tokens}")
+                return ChatCompletion.model_validate_json(response_json)
+            if self.mode == "replay":
+                self.misses += 1
+                raise CacheMissError(f"No cached OpenAI response for key {key[:12]} in replay mode.")
+
+        self.misses += 1
+        response = self._client.chat.completions.create(**params)
+        total_tokens = response.usage.total_tokens if response.usage else 0
+        self.cache.put(key, params, response.model_dump_json(), total_tokens, recorded=self.mode == "record")
+        logging.info(f"OpenAI cache miss ({params.get('model')}, mode={self.mode}): hit rate {self.hit_rate:.0%}, saved tokens {self.saved_tokens}")
+        return response
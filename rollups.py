@@ -0,0 +1,197 @@
+import re
+from datetime import date, timedelta
+
+# -------------------------------------------------------------------
+# 担当者別の集計テーブル (ロールアップ)
+# -------------------------------------------------------------------
+# レポートの保存・編集のたびに差分だけを加減算し、ダッシュボードでは
+# analysis_json を読み直さずに集計済みの行だけを参照する。
+
+STAGES = ("rapport_building", "problem_discovery", "value_addition", "closing")
+TOTAL_STAGE = "total"
+GRADE_POINTS = {"A": 20, "B": 15, "C": 10, "D": 5}
+GRANULARITIES = ("day", "week")
+
+
+def init_rollup_tables(conn):
+    """集計用のテーブルを作成する"""
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS report_scores (
+            report_id INTEGER PRIMARY KEY,
+            sales_rep TEXT NOT NULL,
+            client_company TEXT NOT NULL,
+            report_day TEXT NOT NULL,
+            total_score INTEGER NOT NULL,
+            rapport_building TEXT,
+            problem_discovery TEXT,
+            value_addition TEXT,
+            closing TEXT,
+            sales_ratio REAL
+        );
+        CREATE TABLE IF NOT EXISTS rep_stage_rollups (
+            granularity TEXT NOT NULL,
+            sales_rep TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            period_start TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            points_sum INTEGER NOT NULL,
+            count_a INTEGER NOT NULL,
+            count_b INTEGER NOT NULL,
+            count_c INTEGER NOT NULL,
+            count_d INTEGER NOT NULL,
+            PRIMARY KEY (granularity, sales_rep, stage, period_start)
+        );
+        CREATE INDEX IF NOT EXISTS idx_rep_stage_rollups_period
+            ON rep_stage_rollups (granularity, stage, period_start);
+        CREATE TABLE IF NOT EXISTS rep_client_rollups (
+            sales_rep TEXT NOT NULL,
+            client_company TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            total_score_sum INTEGER NOT NULL,
+            PRIMARY KEY (sales_rep, client_company)
+        );
+    ''')
+
+
+def parse_report_date(report_date, fallback=None):
+    """「2025年08月06日」またはISO形式の商談日を date に変換する"""
+    match = re.search(r'(\d{4})\D(\d{1,2})\D(\d{1,2})', report_date or '')
+    if match:
+        try:
+            return date(*map(int, match.groups()))
+        except ValueError:
+            pass
+    return fallback or date.today()
+
+
+def _period_start(day, granularity):
+    """集計期間の開始日 (週は月曜始まり)"""
+    if granularity == "week":
+        day = day - timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+def _stage_rows(score_row, sign):
+    """report_scores の1行が各集計行に与える寄与を返す"""
+    sales_rep, report_day, total_score = score_row["sales_rep"], date.fromisoformat(score_row["report_day"]), score_row["total_score"]
+    rows = []
+    for granularity in GRANULARITIES:
+        period_start = _period_start(report_day, granularity)
+        for stage in STAGES:
+            grade = score_row[stage]
+            counts = [sign if grade == g else 0 for g in "ABCD"]
+            rows.append((granularity, sales_rep, stage, period_start, sign, sign * GRADE_POINTS.get(grade, 0), *counts))
+        rows.append((granularity, sales_rep, TOTAL_STAGE, period_start, sign, sign * total_score, 0, 0, 0, 0))
+    return rows
+
+
+def _apply(conn, score_row, sign):
+    """集計行に寄与を加算(sign=1)または減算(sign=-1)する"""
+    conn.executemany('''
+        INSERT INTO rep_stage_rollups (granularity, sales_rep, stage, period_start, n, points_sum, count_a, count_b, count_c, count_d)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (granularity, sales_rep, stage, period_start) DO UPDATE SET
+            n = n + excluded.n, points_sum = points_sum + excluded.points_sum,
+            count_a = count_a + excluded.count_a, count_b = count_b + excluded.count_b,
+            count_c = count_c + excluded.count_c, count_d = count_d + excluded.count_d
+    ''', _stage_rows(score_row, sign))
+    conn.execute('''
+        INSERT INTO rep_client_rollups (sales_rep, client_company, n, total_score_sum) VALUES (?, ?, ?, ?)
+        ON CONFLICT (sales_rep, client_company) DO UPDATE SET
+            n = n + excluded.n, total_score_sum = total_score_sum + excluded.total_score_sum
+    ''', (score_row["sales_rep"], score_row["client_company"], sign, sign * score_row["total_score"]))
+    if sign < 0:
+        conn.execute("DELETE FROM rep_stage_rollups WHERE granularity IN ('day', 'week') AND sales_rep = ? AND n <= 0", (score_row["sales_rep"],))
+        conn.execute("DELETE FROM rep_client_rollups WHERE sales_rep = ? AND n <= 0", (score_row["sales_rep"],))
+
+
+def record_report(conn, report_id, sales_rep, client_company, report_date, grades, total_score, sales_ratio=None):
+    """
+    レポートの保存・編集時に呼び出し、集計テーブルを差分更新する。
+    既に集計済みのレポートであれば、以前の寄与を差し引いてから新しい値を加える。
+    コミットは呼び出し側で行う。
+    """
+    columns = ("sales_rep", "client_company", "report_day", "total_score", *STAGES)
+    previous = conn.execute(f"SELECT {', '.join(columns)} FROM report_scores WHERE report_id = ?", (report_id,)).fetchone()
+    if previous:
+        _apply(conn, dict(zip(columns, previous)), -1)
+
+    score_row = {
+        "sales_rep": sales_rep,
+        "client_company": client_company,
+        "report_day": parse_report_date(report_date).isoformat(),
+        "total_score": int(total_score),
+        **{stage: grades.get(stage) for stage in STAGES},
+    }
+    conn.execute(f'''
+        INSERT OR REPLACE INTO report_scores (report_id, {', '.join(columns)}, sales_ratio)
+        VALUES ({', '.join('?' * (len(columns) + 2))})
+    ''', (report_id, *(score_row[column] for column in columns), sales_ratio))
+    _apply(conn, score_row, 1)
+
+
+# -------------------------------------------------------------------
+# ダッシュボード用クエリ
+# -------------------------------------------------------------------
+def rep_summary(conn, sales_rep):
+    """担当者のレポート件数と平均総合スコア"""
+    n, points_sum = conn.execute('''
+        SELECT COALESCE(SUM(n), 0), COALESCE(SUM(points_sum), 0) FROM rep_stage_rollups
+        WHERE granularity = 'week' AND sales_rep = ? AND stage = ?
+    ''', (sales_rep, TOTAL_STAGE)).fetchone()
+    return {"n": n, "avg_score": points_sum / n if n else None}
+
+
+def stage_trend(conn, sales_rep, granularity="week"):
+    """担当者のステージ別・期間別の平均点と評価の内訳"""
+    rows = conn.execute('''
+        SELECT period_start, stage, n, points_sum, count_a, count_b, count_c, count_d FROM rep_stage_rollups
+        WHERE granularity = ? AND sales_rep = ? ORDER BY period_start
+    ''', (granularity, sales_rep)).fetchall()
+    return [
+        {"period_start": period_start, "stage": stage, "n": n, "avg_points": points_sum / n,
+         "grades": {"A": a, "B": b, "C": c, "D": d}}
+        for period_start, stage, n, points_sum, a, b, c, d in rows
+    ]
+
+
+def rep_comparison(conn, granularity="week", stage=TOTAL_STAGE, since=None):
+    """全担当者の期間別の平均点 (担当者間の比較用)"""
+    rows = conn.execute('''
+        SELECT period_start, sales_rep, n, points_sum FROM rep_stage_rollups
+        WHERE granularity = ? AND stage = ? AND period_start >= ? ORDER BY period_start, sales_rep
+    ''', (granularity, stage, since or "")).fetchall()
+    return [
+        {"period_start": period_start, "sales_rep": sales_rep, "n": n, "avg_points": points_sum / n}
+        for period_start, sales_rep, n, points_sum in rows
+    ]
+
+
+def client_breakdown(conn, sales_rep, limit=20):
+    """担当者の顧客企業別の商談件数と平均総合スコア"""
+    rows = conn.execute('''
+        SELECT client_company, n, total_score_sum FROM rep_client_rollups
+        WHERE sales_rep = ? ORDER BY n DESC, client_company LIMIT ?
+    ''', (sales_rep, limit)).fetchall()
+    return [
+        {"client_company": client_company, "n": n, "avg_score": total_score_sum / n}
+        for client_company, n, total_score_sum in rows
+    ]
+
+
+def recent_reports(conn, sales_rep, limit=20, offset=0):
+    """担当者の新しい順のレポート1ページ分 (reports(sales_rep, timestamp) の索引を使う)"""
+    return conn.execute('''
+        SELECT analysis_json, report_date, client_company FROM reports
+        WHERE sales_rep = ? ORDER BY timestamp DESC LIMIT ? OFFSET ?
+    ''', (sales_rep, limit, offset)).fetchall()
+
+
+def feedback_page_data(conn, sales_rep, granularity="week", page=1, page_size=20, since=None):
+    """フィードバックページの1回の表示で発行するクエリ一式"""
+    return {
+        "trend": stage_trend(conn, sales_rep, granularity),
+        "comparison": rep_comparison(conn, granularity, since=since),
+        "clients": client_breakdown(conn, sales_rep),
+        "reports": recent_reports(conn, sales_rep, page_size, (page - 1) * page_size),
+    }
@@ -0,0 +1,162 @@
+import re
+
+import numpy as np
+
+# -------------------------------------------------------------------
+# 会話分析指標 (話者分離の区間から算出)
+# -------------------------------------------------------------------
+# 同一話者の区間の間隔がこの秒数以下なら、1つのターンとしてまとめる
+TURN_MERGE_GAP_SECONDS = 1.0
+# 他の話者のターンとこの秒数以上重なって始まったターンを割り込みとみなす
+# (話者交代時の数十ミリ秒程度の区間の重なりは割り込みに数えない)
+INTERRUPTION_MIN_OVERLAP_SECONDS = 0.5
+# 区間情報のない過去レポートで、最後の発話の長さを見積もるための発話速度(文字/秒)
+ESTIMATED_CHARS_PER_SECOND = 8.0
+
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[。．？?！!])')
+QUESTION_PATTERN = re.compile(r'([?？]|か(ね|な)?[。．]?)$')
+
+
+def count_questions(text):
+    """発言に含まれる疑問文の数を数える (「？」または「〜か」で終わる文)"""
+    sentences = (sentence.strip() for sentence in SENTENCE_SPLIT_PATTERN.split(text or ''))
+    return sum(1 for sentence in sentences if sentence and QUESTION_PATTERN.search(sentence))
+
+
+def compute_talk_metrics(starts, ends, speakers, sales_speaker, utterances=None, source="diarization"):
+    """
+    話者ごとの発話区間から、発話時間・ターン数・割り込み・重なり・最長モノローグ・質問率を算出する。
+    戻り値はJSONとしてそのまま保存できる辞書。
+    """
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    speakers = np.asarray(speakers, dtype=str)
+    metrics = {
+        "source": source,
+        "sales_speaker": sales_speaker,
+        "total_speaking_seconds": 0.0,
+        "overlap_seconds": 0.0,
+        "sales_ratio": None,
+        "speakers": {},
+    }
+    if starts.size == 0:
+        return metrics
+
+    order = np.argsort(starts, kind="stable")
+    starts, ends, speakers = starts[order], ends[order], speakers[order]
+    labels, codes = np.unique(speakers, return_inverse=True)
+    num_speakers = len(labels)
+
+    # 発話時間
+    speaking_seconds = np.bincount(codes, weights=ends - starts, minlength=num_speakers)
+
+    # ターン: 同一話者の連続した区間をまとめる
+    new_turn = np.r_[True, (codes[1:] != codes[:-1]) | (starts[1:] - ends[:-1] > TURN_MERGE_GAP_SECONDS)]
+    turn_index = np.flatnonzero(new_turn)
+    turn_starts = np.minimum.reduceat(starts, turn_index)
+    turn_ends = np.maximum.reduceat(ends, turn_index)
+    turn_codes = codes[turn_index]
+    turns = np.bincount(turn_codes, minlength=num_speakers)
+    longest_monologue = np.zeros(num_speakers)
+    np.maximum.at(longest_monologue, turn_codes, turn_ends - turn_starts)
+
+    # 割り込み: 他の話者のターンの途中で始まり、一定以上重なったターン
+    overlap_after_start = np.minimum(turn_ends[None, :], turn_ends[:, None]) - turn_starts[None, :]
+    interrupts = (
+        (turn_starts[None, :] > turn_starts[:, None])
+        & (overlap_after_start >= INTERRUPTION_MIN_OVERLAP_SECONDS)
+        & (turn_codes[None, :] != turn_codes[:, None])
+    ).any(axis=0)
+    interruptions = np.bincount(turn_codes[interrupts], minlength=num_speakers)
+
+    # 重なり: 区間の境界で時間軸を分割し、各小区間で同時に話している話者数を数える
+    boundaries = np.unique(np.r_[starts, ends])
+    midpoints = (boundaries[:-1] + boundaries[1:]) / 2
+    segment_seconds = np.diff(boundaries)
+    active = (starts[:, None] <= midpoints[None, :]) & (ends[:, None] > midpoints[None, :])
+    speaker_active = np.zeros((num_speakers, midpoints.size), dtype=bool)
+    np.logical_or.at(speaker_active, codes, active)
+    num_active = speaker_active.sum(axis=0)
+
+    # 質問数
+    questions = np.zeros(num_speakers, dtype=int)
+    label_index = {label: i for i, label in enumerate(labels)}
+    for utterance in utterances or []:
+        index = label_index.get(utterance.get('speaker'))
+        if index is not None:
+            questions[index] += count_questions(utterance.get('text', ''))
+
+    # 話者ごとの発話時間の合計 (重なっている時間は話者の数だけ数える)。
+    # 営業担当者の比率は各話者の比率の合計が100%になるよう、この合計を分母にする。
+    total_speaking = float(speaking_seconds.sum())
+    metrics["total_speaking_seconds"] = total_speaking
+    metrics["overlap_seconds"] = float(segment_seconds[num_active > 1].sum())
+    if sales_speaker in label_index and total_speaking > 0:
+        metrics["sales_ratio"] = float(speaking_seconds[label_index[sales_speaker]] / total_speaking * 100)
+
+    for i, label in enumerate(labels):
+        minutes = speaking_seconds[i] / 60
+        metrics["speakers"][label] = {
+            "is_sales_rep": label == sales_speaker,
+            "speaking_seconds": float(speaking_seconds[i]),
+            "turns": int(turns[i]),
+            "interruptions": int(interruptions[i]),
+            "longest_monologue_seconds": float(longest_monologue[i]),
+            "questions": int(questions[i]),
+            "questions_per_minute": float(questions[i] / minutes) if minutes > 0 else 0.0,
+        }
+    return metrics
+
+
+def talk_metrics_from_diarization(speaker_turns, utterances, sales_speaker):
+    """話者分離の区間 ({'start', 'end', 'speaker'}) から会話分析指標を算出する"""
+    return compute_talk_metrics(
+        [turn['start'] for turn in speaker_turns],
+        [turn['end'] for turn in speaker_turns],
+        [turn['speaker'] for turn in speaker_turns],
+        sales_speaker,
+        utterances=utterances,
+        source="diarization",
+    )
+
+
+def _parse_timestamp(value):
+    """'H:MM:SS' / 'MM:SS' 形式の文字列を秒に変換する"""
+    seconds = 0.0
+    try:
+        for part in str(value).split(':'):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        return None
+    return seconds
+
+
+def talk_metrics_from_transcript(transcript, sales_rep):
+    """
+    区間情報を持たない過去のレポート向けに、整形済み文字起こしの開始時刻から区間を見積もって指標を算出する。
+    各発言は次の発言の開始まで続いたものとみなす。
+    """
+    items = [item for item in transcript or [] if _parse_timestamp(item.get('start_time')) is not None]
+    starts = np.array([_parse_timestamp(item['start_time']) for item in items], dtype=float)
+    estimated_ends = starts + np.array([len(item.get('text', '')) for item in items]) / ESTIMATED_CHARS_PER_SECOND
+    next_starts = np.r_[starts[1:], -np.inf] if starts.size else starts
+    ends = np.where(next_starts > starts, next_starts, estimated_ends)
+
+    # 整形済み文字起こしでは、営業担当者は氏名または「営業担当」の表記で識別される
+    rep_name = (sales_rep or '').replace(' ', '').replace('　', '')
+    speakers = [item.get('speaker', '') for item in items]
+    sales_speaker = next((s for s in speakers if rep_name and rep_name in s.replace(' ', '').replace('　', '')), None)
+    if sales_speaker is None:
+        sales_speaker = next((s for s in speakers if '営業担当' in s), None)
+
+    return compute_talk_metrics(starts, ends, speakers, sales_speaker, utterances=items, source="transcript")
+
+
+def talk_metrics_for_report(speaker_turns, utterances, sales_speaker, cleaned_transcript, sales_rep):
+    """
+    レポート1件分の会話分析指標を算出する。
+    話者分離の区間とGPTが特定した営業担当者のラベルがあればそれを使い、なければ文字起こしから見積もる。
+    """
+    if speaker_turns and sales_speaker in {turn['speaker'] for turn in speaker_turns}:
+        return talk_metrics_from_diarization(speaker_turns, utterances, sales_speaker)
+    return talk_metrics_from_transcript(cleaned_transcript, sales_rep)
@@ -0,0 +1,258 @@
+import logging
+import time
+from datetime import timedelta
+
+import numpy as np
+import torch
+import whisper
+from pyannote.audio import Pipeline
+
+SAMPLE_RATE = 16000
+
+# -------------------------------------------------------------------
+# Whisper 推論バックエンド
+# -------------------------------------------------------------------
+# fp32: 従来どおりの推論 (GPUがあればGPUを使用)
+# int8: Linear層を動的int8量子化したCPU推論
+WHISPER_BACKENDS = ("fp32", "int8")
+
+
+def configure_torch_threads(num_threads=0, num_interop_threads=0):
+    """torchのスレッド数を設定する。0の場合はtorchの既定値のままにする。"""
+    if num_threads and int(num_threads) > 0:
+        torch.set_num_threads(int(num_threads))
+    if num_interop_threads and int(num_interop_threads) > 0:
+        try:
+            torch.set_num_interop_threads(int(num_interop_threads))
+        except RuntimeError as e:
+            # interopスレッド数は並列処理の開始後には変更できない
+            logging.warning(f"Could not set torch interop threads: {e}")
+    logging.info(f"Torch threads: intra-op={torch.get_num_threads()}, inter-op={torch.get_num_interop_threads()}")
+
+
+def _replace_whisper_linear_layers(module):
+    """
+    whisper独自のLinear(nn.Linearのサブクラス)を素のnn.Linearに置き換える。
+    quantize_dynamicは型の完全一致で対象を判定するため、置き換えないと量子化されない。
+    """
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            linear.load_state_dict(child.state_dict())
+            setattr(module, name, linear)
+        else:
+            _replace_whisper_linear_layers(child)
+
+
+def load_whisper_model(model_name, backend="fp32", device=None):
+    """指定されたバックエンドでWhisperモデルを読み込む"""
+    if backend not in WHISPER_BACKENDS:
+        raise ValueError(f"Unknown whisper backend: {backend} (expected one of {WHISPER_BACKENDS})")
+
+    if backend == "int8":
+        # 動的int8量子化はCPUでのみ動作する
+        model = whisper.load_model(model_name, device="cpu")
+        model.eval()
+        _replace_whisper_linear_layers(model)
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        logging.info(f"Whisper model '{model_name}' loaded with dynamic int8 quantization on CPU.")
+        return model
+
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = whisper.load_model(model_name, device=device)
+    logging.info(f"Whisper model '{model_name}' loaded in fp32 on {device}.")
+    return model
+
+
+def transcribe(whisper_model, audio, backend="fp32", initial_prompt=None):
+    """日本語・単語タイムスタンプ付きで文字起こしを行う"""
+    # CPU推論(int8含む)ではfp16を使えないため明示的に無効化する
+    use_fp16 = backend == "fp32" and whisper_model.device.type == "cuda"
+    return whisper_model.transcribe(audio, word_timestamps=True, language="ja", fp16=use_fp16, initial_prompt=initial_prompt)
+
+
+# -------------------------------------------------------------------
+# 話者分離と文字起こしの結合
+# -------------------------------------------------------------------
+def format_timestamp(seconds):
+    """秒をHH:MM:SS形式の文字列に変換する"""
+    return str(timedelta(seconds=int(seconds)))
+
+
+def load_diarization_pipeline(hf_token):
+    """pyannoteの話者分離パイプラインを読み込む"""
+    diarization_pipeline = Pipeline.from_pretrained("pyannote/speaker-diarization-3.1", use_auth_token=hf_token)
+    if torch.cuda.is_available(): diarization_pipeline.to(torch.device("cuda"))
+    return diarization_pipeline
+
+
+def diarization_to_turns(diarization, offset=0.0, speaker_map=None):
+    """pyannoteの話者分離結果を {'start', 'end', 'speaker'} のリストに変換する"""
+    speaker_map = speaker_map or {}
+    return [
+        {'start': turn.start + offset, 'end': turn.end + offset, 'speaker': speaker_map.get(speaker, speaker)}
+        for turn, _, speaker in diarization.itertracks(yield_label=True)
+    ]
+
+
+def merge_words_with_speakers(word_timestamps, speaker_turns):
+    """単語ごとに話者を割り当て、同一話者の連続する単語を1つの発話にまとめる"""
+    utterances = []
+    if not word_timestamps:
+        return utterances
+
+    for word in word_timestamps:
+        word_center = word['start'] + (word['end'] - word['start']) / 2
+        word['speaker'] = next((turn['speaker'] for turn in speaker_turns if turn['start'] <= word_center <= turn['end']), 'UNKNOWN')
+
+    current = {'speaker': word_timestamps[0]['speaker'], 'text': "", 'start': word_timestamps[0]['start'], 'end': word_timestamps[0]['end']}
+    for word in word_timestamps:
+        if word['speaker'] != current['speaker']:
+            utterances.append(current)
+            current = {'speaker': word['speaker'], 'text': "", 'start': word['start'], 'end': word['end']}
+        current['text'] += word['word']
+        current['end'] = word['end']
+    utterances.append(current)
+
+    for utterance in utterances:
+        utterance['text'] = utterance['text'].strip()
+        utterance['start_time'] = format_timestamp(utterance['start'])
+    return utterances
+
+
+def format_transcript_text(utterances):
+    """GPTへの入力用に発話リストを「話者 (時刻): 発言」形式のテキストにする"""
+    return "".join(f"{u['speaker']} ({u['start_time']}): {u['text']}\n" for u in utterances)
+
+
+# -------------------------------------------------------------------
+# ストリーミング(ローリングウィンドウ)文字起こし
+# -------------------------------------------------------------------
+class SpeakerTracker:
+    """
+    ウィンドウごとに独立して付与される話者ラベルを、話者埋め込みの重心との
+    コサイン類似度で照合し、音声全体で一貫したラベルに対応付ける。
+    """
+
+    def __init__(self, similarity_threshold=0.3):
+        # pyannote 3.1のクラスタリング閾値(コサイン距離≒0.70)に合わせた既定値
+        self.similarity_threshold = similarity_threshold
+        self.centroids = []
+        self.counts = []
+
+    def assign(self, labels, embeddings):
+        """ウィンドウ内の話者ラベル -> 全体の話者ラベル の対応表を返す"""
+        speaker_map = {}
+        used = set()
+        for label, embedding in zip(labels, embeddings if embeddings is not None else [None] * len(labels)):
+            # 埋め込みがない話者 (NaN、またはpyannoteが重心の不足分を埋めるゼロ行) は照合できない
+            norm = np.linalg.norm(embedding) if embedding is not None else 0.0
+            if not np.isfinite(norm) or norm == 0.0:
+                speaker_map[label] = 'UNKNOWN'
+                continue
+            embedding = embedding / norm
+
+            best_index, best_similarity = None, self.similarity_threshold
+            for index, centroid in enumerate(self.centroids):
+                if index in used:
+                    continue
+                similarity = float(np.dot(embedding, centroid / (np.linalg.norm(centroid) or 1.0)))
+                if similarity >= best_similarity:
+                    best_index, best_similarity = index, similarity
+
+            if best_index is None:
+                self.centroids.append(embedding.copy())
+                self.counts.append(1)
+                best_index = len(self.centroids) - 1
+            else:
+                count = self.counts[best_index]
+                self.centroids[best_index] = (self.centroids[best_index] * count + embedding) / (count + 1)
+                self.counts[best_index] = count + 1
+
+            used.add(best_index)
+            speaker_map[label] = f"SPEAKER_{best_index:02d}"
+        return speaker_map
+
+
+def _window_bounds(audio, window_samples, min_samples, search_samples, frame_samples=320):
+    """
+    ウィンドウの区間(サンプル単位)を求める。
+    単語や話者のターンを途中で切らないよう、目標の長さの手前 search_samples の範囲で
+    最も音量の小さいフレーム(無音部分)の中央で区切る。短すぎる末尾は直前のウィンドウに含める。
+    """
+    total_samples = len(audio)
+    bounds = []
+    start = 0
+    while start < total_samples:
+        end = min(start + window_samples, total_samples)
+        if total_samples - end < min_samples:
+            end = total_samples
+        else:
+            search_start = max(start + min_samples, end - search_samples)
+            num_frames = (end - search_start) // frame_samples
+            if num_frames > 0:
+                frames = audio[search_start:search_start + num_frames * frame_samples].reshape(num_frames, frame_samples)
+                quietest = int(np.argmin(np.mean(frames.astype(np.float32) ** 2, axis=1)))
+                end = search_start + quietest * frame_samples + frame_samples // 2
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def stream_transcription(audio_path, diarization_pipeline, whisper_model, backend="fp32", window_seconds=30.0, min_window_seconds=5.0, search_seconds=5.0):
+    """
+    音声をローリングウィンドウ(区切りは目標の長さ付近の無音部分)に分割し、ウィンドウごとに話者分離と文字起こしを行って
+    話者付きの発話を逐次yieldするジェネレータ。Streamlitに依存しない。
+
+    各yieldは以下のキーを持つ辞書:
+        window_index, num_windows, window_start, window_end, utterances,
+        speaker_turns, transcript_text, elapsed_seconds, time_to_first_utterance
+    """
+    started = time.perf_counter()
+    audio = whisper.load_audio(audio_path)
+    bounds = _window_bounds(
+        audio, int(window_seconds * SAMPLE_RATE), int(min_window_seconds * SAMPLE_RATE), int(search_seconds * SAMPLE_RATE)
+    )
+    tracker = SpeakerTracker()
+    time_to_first_utterance = None
+    previous_text = ""
+
+    for window_index, (start, end) in enumerate(bounds):
+        chunk = audio[start:end]
+        offset = start / SAMPLE_RATE
+
+        diarization, embeddings = diarization_pipeline(
+            {"waveform": torch.from_numpy(chunk).unsqueeze(0), "sample_rate": SAMPLE_RATE},
+            return_embeddings=True,
+        )
+        speaker_map = tracker.assign(diarization.labels(), embeddings)
+        speaker_turns = diarization_to_turns(diarization, offset=offset, speaker_map=speaker_map)
+
+        # 直前のウィンドウの末尾をプロンプトとして渡し、ウィンドウ間の文脈を保つ
+        result = transcribe(whisper_model, chunk, backend=backend, initial_prompt=previous_text[-200:] or None)
+        previous_text += result['text']
+        word_timestamps = [
+            {**word, 'start': word['start'] + offset, 'end': word['end'] + offset}
+            for segment in result['segments'] for word in segment.get('words', [])
+        ]
+        utterances = merge_words_with_speakers(word_timestamps, speaker_turns)
+
+        elapsed = time.perf_counter() - started
+        if utterances and time_to_first_utterance is None:
+            time_to_first_utterance = elapsed
+            logging.info(f"Streaming transcription: time to first utterance {time_to_first_utterance:.2f}s")
+
+        yield {
+            'window_index': window_index,
+            'num_windows': len(bounds),
+            'window_start': offset,
+            'window_end': end / SAMPLE_RATE,
+            'utterances': utterances,
+            'speaker_turns': speaker_turns,
+            'transcript_text': format_transcript_text(utterances),
+            'elapsed_seconds': elapsed,
+            'time_to_first_utterance': time_to_first_utterance,
+        }
+
+    logging.info(f"Streaming transcription finished: {len(bounds)} windows in {time.perf_counter() - started:.2f}s")